@@ -3,6 +3,7 @@ import os
 import argparse
 import yaml
 args = None
+base_cli_args = None
 
 def parse_hp_string(hp_string):
     result = {}
@@ -44,12 +45,20 @@ def parse_args():
     # 定义 argparse 参数
     parser.add_argument("--exp_path", type=str, help="Path to save the model.")
     parser.add_argument("--input_file", type=str, help="Path to inference txt.")
+    parser.add_argument("--metrics_out", type=str, default=None, help="Path to write profiling metrics as JSON.")
+    parser.add_argument("--serve", action='store_true', help="Serve profiling requests over stdin instead of running once.")
+    parser.add_argument("--shm_name", type=str, default=None, help="Shared-memory block to write packed profiling metrics into.")
     parser.add_argument("--debug", action='store_true', default=None)
     parser.add_argument("--infer", action='store_true')
     parser.add_argument("-hp", "--hparams", type=str, default="")
 
     args = parser.parse_args()
 
+    # Snapshot of the raw CLI namespace, so a resident server (profile_inference
+    # --serve) can reset to it before overlaying each newly requested config
+    global base_cli_args
+    base_cli_args = dict(vars(args))
+
     # 读取 YAML 配置（如果提供了 --config 参数）
     if args.config:
         with open(args.config, "r") as f:
@@ -40,10 +40,22 @@ def set_seed(seed: int = 42):
     torch.cuda.manual_seed(seed)  # 设置当前GPU
     torch.cuda.manual_seed_all(seed)  # 设置所有GPU
 
-def read_from_file(p):
-    with open(p, "r") as fin:
-        for l in fin:
-            yield l.strip()
+def read_from_file(p, byte_range=None):
+    if byte_range is None:
+        with open(p, "r") as fin:
+            for l in fin:
+                yield l.strip()
+    else:
+        # Only yield the newline-aligned [start, end) slice of the file
+        start, end = byte_range
+        with open(p, "rb") as fin:
+            fin.seek(start)
+            pos = start
+            for l in fin:
+                pos += len(l)
+                yield l.decode().strip()
+                if pos >= end:
+                    break
 
 def match_size(image_size, h, w):
     ratio_ = 9999
@@ -344,22 +356,16 @@ class WanInferencePipeline(nn.Module):
         return video
 
 
-def main():
-    set_seed(args.seed)
+def run_inference(inferpipe, input_file, byte_range=None, tag=None):
     # laod data
-    data_iter = read_from_file(args.input_file)
+    data_iter = read_from_file(input_file, byte_range=byte_range)
     exp_name = os.path.basename(args.exp_path)
     seq_len = args.seq_len
     date_name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    # Text-to-video
-    print("[Profiler] Loading model...")
-    t0 = time.time()
-    inferpipe = WanInferencePipeline(args)
-    print(f"[Profiler] Model loaded in {time.time() - t0:.2f} seconds.")
     if args.sp_size > 1:
         date_name = inferpipe.pipe.sp_group.broadcast_object_list([date_name])
         date_name = date_name[0]
-    output_dir = f'demo_out/{exp_name}/res_{os.path.splitext(os.path.basename(args.input_file))[0]}_'\
+    output_dir = f'demo_out/{exp_name}/res_{os.path.splitext(os.path.basename(input_file))[0]}_'\
                 f'seed{args.seed}_step{args.num_steps}_cfg{args.guidance_scale}_'\
                 f'ovlp{args.overlap_frame}_{args.max_tokens}_{args.fps}_{date_name}'
     if args.tea_cache_l1_thresh > 0:
@@ -368,6 +374,8 @@ def main():
         output_dir = f'{output_dir}_acfg{args.audio_scale}'
     if args.max_hw == 1280:
         output_dir = f'{output_dir}_720p'
+    if tag is not None:
+        output_dir = f'{output_dir}_{tag}'
     for idx, text in tqdm(enumerate(data_iter)):
         if len(text) == 0:
             continue
@@ -418,6 +426,15 @@ def main():
         if dist.get_rank() == 0:
             print(f"[Profiler] Saving/output for sample {idx} took {time.time() - t2:.2f} seconds.")
 
+def main():
+    set_seed(args.seed)
+    # Text-to-video
+    print("[Profiler] Loading model...")
+    t0 = time.time()
+    inferpipe = WanInferencePipeline(args)
+    print(f"[Profiler] Model loaded in {time.time() - t0:.2f} seconds.")
+    run_inference(inferpipe, args.input_file)
+
 class NoPrint:
     def write(self, x):
         pass
@@ -1,57 +1,216 @@
+import asyncio
+import queue
 import subprocess
 import os, sys
 import time
+import tempfile
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import argparse
 from pathlib import Path
 
-def run_inference_job(job_config):
-    """Run a single inference job"""
-    config_file, input_file, output_suffix, gpu_id = job_config
-    
-    env = os.environ.copy()
-    env['CUDA_VISIBLE_DEVICES'] = str(gpu_id)
-    
-    cmd = [
-        'torchrun', 
-        '--standalone', 
-        '--nproc_per_node=1',
-        'scripts/inference.py',
-        '--config', config_file,
-        '--input_file', input_file
-    ]
-    
-    print(f"🚀 Starting job on GPU {gpu_id}: {config_file} -> {input_file}")
-    start_time = time.time()
-    
+def start_mps(per_gpu_jobs):
+    """Start the CUDA MPS control daemon so jobs sharing a GPU overlap instead of serializing"""
+    mps_dir = tempfile.mkdtemp(prefix='omni_mps_')
+    os.environ['CUDA_MPS_PIPE_DIRECTORY'] = os.path.join(mps_dir, 'pipe')
+    os.environ['CUDA_MPS_LOG_DIRECTORY'] = os.path.join(mps_dir, 'log')
+    os.makedirs(os.environ['CUDA_MPS_PIPE_DIRECTORY'], exist_ok=True)
+    os.makedirs(os.environ['CUDA_MPS_LOG_DIRECTORY'], exist_ok=True)
+    # Cap each client's SM share so per_gpu_jobs workers split the GPU evenly
+    os.environ['CUDA_MPS_ACTIVE_THREAD_PERCENTAGE'] = str(max(1, 100 // per_gpu_jobs))
+
     try:
-        result = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
-        elapsed = time.time() - start_time
-        print(f"✅ GPU {gpu_id} completed in {elapsed:.1f}s: {input_file}")
-        return {'gpu': gpu_id, 'success': True, 'time': elapsed, 'file': input_file}
-    except subprocess.CalledProcessError as e:
-        elapsed = time.time() - start_time
-        print(f"❌ GPU {gpu_id} failed after {elapsed:.1f}s: {input_file}")
-        print(f"Error: {e.stderr}")
-        return {'gpu': gpu_id, 'success': False, 'time': elapsed, 'file': input_file, 'error': e.stderr}
-
-def split_input_file(input_file, num_chunks):
-    """Split input file into chunks for parallel processing"""
-    with open(input_file, 'r') as f:
-        lines = [line.strip() for line in f if line.strip()]
-    
-    chunk_size = max(1, len(lines) // num_chunks)
-    chunks = []
-    
-    for i in range(0, len(lines), chunk_size):
-        chunk_lines = lines[i:i + chunk_size]
-        chunk_file = f"{input_file}_chunk_{i//chunk_size}.txt"
-        with open(chunk_file, 'w') as f:
-            f.write('\n'.join(chunk_lines))
-        chunks.append(chunk_file)
-    
-    return chunks
+        subprocess.run(['nvidia-cuda-mps-control', '-d'], check=True)
+        print(f"🔀 MPS daemon started (pipe dir: {mps_dir})")
+        return mps_dir
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"⚠️  Could not start MPS daemon: {e}")
+        return None
+
+def stop_mps():
+    """Shut down the CUDA MPS control daemon"""
+    try:
+        subprocess.run(['nvidia-cuda-mps-control'], input='quit\n', text=True, check=True)
+        print("🔀 MPS daemon stopped")
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"⚠️  Could not stop MPS daemon: {e}")
+
+class InferenceJob:
+    """Payload describing one chunk of work for a persistent GPU worker"""
+    def __init__(self, config_file, input_file, output_suffix, byte_range=None):
+        self.config_file = config_file
+        self.input_file = input_file
+        self.output_suffix = output_suffix
+        self.byte_range = byte_range
+
+    def __getstate__(self):
+        return {'config_file': self.config_file,
+                'input_file': self.input_file,
+                'output_suffix': self.output_suffix,
+                'byte_range': self.byte_range}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+def tail_log(log_path, nbytes=2048):
+    """Last nbytes of a log file, for failure reports"""
+    try:
+        with open(log_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - nbytes))
+            return f.read().decode(errors='replace')
+    except OSError:
+        return ''
+
+def worker_main(worker_idx, gpu_id, config_file, log_path, input_q, result_q, cpus=None):
+    """Long-lived per-GPU worker: loads the pipeline once, then serves chunks from the queue"""
+    # Send this worker's (very chatty) output to the log file the parent
+    # assigned, so the parent can tail it even if this process dies
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
+
+    # Pin host-side threads (dataloader, audio preprocessing) to the CPUs on
+    # the GPU's NUMA node so they don't bounce across the socket interconnect
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+
+    # Pin the worker to its GPU and fake a single-process torchrun env
+    # before torch/the pipeline get imported
+    os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu_id)
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ['MASTER_PORT'] = str(29500 + worker_idx)
+    os.environ['RANK'] = '0'
+    os.environ['WORLD_SIZE'] = '1'
+    os.environ['LOCAL_RANK'] = '0'
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.argv = ['inference.py', '--config', config_file]
+    import inference  # parses args from sys.argv and pulls in the model stack
+
+    inference.set_seed(inference.args.seed)
+
+    print(f"🔧 Worker {worker_idx} (GPU {gpu_id}) loading model...")
+    t0 = time.time()
+    inferpipe = inference.WanInferencePipeline(inference.args)
+    print(f"🔧 Worker {worker_idx} (GPU {gpu_id}) model loaded in {time.time() - t0:.1f}s")
+
+    while True:
+        job = input_q.get()
+        if job is None:
+            break
+
+        print(f"🚀 Starting job on GPU {gpu_id}: {job.config_file} -> {job.input_file} ({job.output_suffix})")
+        start_time = time.time()
+
+        try:
+            inference.run_inference(inferpipe, job.input_file,
+                                    byte_range=job.byte_range, tag=job.output_suffix)
+            elapsed = time.time() - start_time
+            print(f"✅ GPU {gpu_id} completed in {elapsed:.1f}s: {job.input_file}")
+            result_q.put({'gpu': gpu_id, 'success': True, 'time': elapsed, 'file': job.input_file, 'log': log_path})
+        except Exception as e:
+            elapsed = time.time() - start_time
+            print(f"❌ GPU {gpu_id} failed after {elapsed:.1f}s: {job.input_file}")
+            print(f"Error: {e}")
+            result_q.put({'gpu': gpu_id, 'success': False, 'time': elapsed, 'file': job.input_file, 'error': str(e), 'log': log_path})
+
+def parse_cpulist(cpulist):
+    """Expand a kernel cpulist string like '0-15,32-47' into a set of CPU ids"""
+    cpus = set()
+    for part in cpulist.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+def gpu_numa_nodes():
+    """Map CUDA GPU ids to NUMA nodes via their PCI bus ids
+
+    Resolved through nvidia-smi rather than DRM card indexes, which shift on
+    boards whose first VGA device is not an NVIDIA GPU (e.g. a BMC).
+    """
+    try:
+        out = subprocess.run(['nvidia-smi', '--query-gpu=index,pci.bus_id', '--format=csv,noheader'],
+                             capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+
+    nodes = {}
+    for line in out.splitlines():
+        if ',' not in line:
+            continue
+        idx, bus_id = [part.strip() for part in line.split(',')]
+        # nvidia-smi reports 00000000:81:00.0; sysfs uses a 4-digit domain
+        parts = bus_id.lower().split(':')
+        parts[0] = parts[0][-4:]
+        try:
+            with open(f"/sys/bus/pci/devices/{':'.join(parts)}/numa_node") as f:
+                nodes[int(idx)] = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+    return nodes
+
+def numa_node_cpus(node):
+    """CPUs on a NUMA node, or None if the topology is unknown"""
+    if node is None or node < 0:  # single-socket or no NUMA info exposed
+        return None
+    try:
+        with open(f'/sys/devices/system/node/node{node}/cpulist') as f:
+            cpus = parse_cpulist(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return cpus or None
+
+def next_newline(fd, offset, fsize):
+    """Return the byte position just past the first newline at or after offset"""
+    os.lseek(fd, offset, os.SEEK_SET)
+    pos = offset
+    while True:
+        buf = os.read(fd, 65536)
+        if not buf:
+            return fsize
+        idx = buf.find(b'\n')
+        if idx != -1:
+            return pos + idx + 1
+        pos += len(buf)
+
+def compute_chunk_ranges(input_file, num_chunks):
+    """Compute newline-aligned [start, end) byte ranges covering the input file
+
+    The ranges travel with the jobs and workers read their slice of the
+    original file directly, so splitting materializes nothing on disk.
+    """
+    fsize = os.path.getsize(input_file)
+    step = max(1, fsize // num_chunks)
+    ranges = []
+
+    src = os.open(input_file, os.O_RDONLY)
+    try:
+        start = 0
+        for i in range(num_chunks):
+            if start >= fsize:
+                break
+            if i == num_chunks - 1:
+                end = fsize
+            else:
+                end = next_newline(src, min((i + 1) * step, fsize), fsize)
+            if end <= start:
+                continue
+            ranges.append((start, end))
+            start = end
+    finally:
+        os.close(src)
+
+    return ranges
 
 def main():
     parser = argparse.ArgumentParser(description='Run OmniAvatar inference in parallel across multiple GPUs')
@@ -60,7 +219,8 @@ def main():
     parser.add_argument('--gpus', default='0,1,2,3', help='Comma-separated list of GPU IDs to use')
     parser.add_argument('--per_gpu_jobs', type=int, default=1, help='Number of parallel jobs per GPU')
     parser.add_argument('--split_input', action='store_true', help='Split input file across GPUs')
-    
+    parser.add_argument('--mps', action='store_true', help='Start the CUDA MPS daemon so jobs sharing a GPU run concurrently')
+
     args = parser.parse_args()
     
     gpu_ids = [int(x.strip()) for x in args.gpus.split(',')]
@@ -77,34 +237,123 @@ def main():
     jobs = []
     
     if args.split_input:
-        # Split input file and assign chunks to different processes
-        chunk_files = split_input_file(args.input_file, total_processes)
-        for i, chunk_file in enumerate(chunk_files):
-            gpu_id = gpu_ids[i % len(gpu_ids)]
-            jobs.append((args.config, chunk_file, f"chunk_{i}", gpu_id))
+        # Split the input file into byte ranges assigned to different processes
+        chunk_ranges = compute_chunk_ranges(args.input_file, total_processes)
+        for i, byte_range in enumerate(chunk_ranges):
+            jobs.append(InferenceJob(args.config, args.input_file, f"chunk_{i}", byte_range))
     else:
         # Run the same input file on all processes (useful for different configs)
         for gpu_id in gpu_ids:
             for job_idx in range(args.per_gpu_jobs):
-                jobs.append((args.config, args.input_file, f"gpu{gpu_id}_job{job_idx}", gpu_id))
-    
+                jobs.append(InferenceJob(args.config, args.input_file, f"gpu{gpu_id}_job{job_idx}"))
+
     print(f"📋 Prepared {len(jobs)} jobs")
-    
-    # Run jobs in parallel
+
+    # MPS lets the per_gpu_jobs workers sharing a CUDA_VISIBLE_DEVICES value
+    # overlap on the GPU instead of serializing on the scheduler
+    mps_dir = start_mps(args.per_gpu_jobs) if args.mps else None
+
+    # Spawn one persistent worker per slot; each loads the pipeline once
+    # and then pulls chunks off a shared bounded queue
+    ctx = mp.get_context('spawn')
+    input_q = ctx.Queue(maxsize=2 * total_processes)
+    result_q = ctx.Queue()
+
+    # Map each GPU to the CPUs on its NUMA node once, up front
+    numa_nodes = gpu_numa_nodes()
+    cpu_map = {gpu_id: numa_node_cpus(numa_nodes.get(gpu_id)) for gpu_id in gpu_ids}
+    for gpu_id, cpus in cpu_map.items():
+        if cpus:
+            print(f"📌 GPU {gpu_id}: pinning workers to CPUs {min(cpus)}-{max(cpus)}")
+
+    # Never spawn more (model-loading) workers than there are jobs
+    num_workers = min(total_processes, len(jobs))
+
+    os.makedirs('logs', exist_ok=True)
+    run_ts = time.strftime('%Y%m%d_%H%M%S')
+
+    workers = []
+    for i in range(num_workers):
+        gpu_id = gpu_ids[i % len(gpu_ids)]
+        log_path = f"logs/gpu{gpu_id}_worker{i}_{run_ts}.log"
+        p = ctx.Process(target=worker_main,
+                        args=(i, gpu_id, args.config, log_path, input_q, result_q, cpu_map[gpu_id]),
+                        daemon=True)
+        p.start()
+        workers.append((p, gpu_id, log_path))
+
+    # Run jobs in parallel. Feeding the bounded input queue and draining
+    # results are supervised concurrently, so progress is reported as soon as
+    # a result lands even while the feeder is blocked on a full queue. Worker
+    # liveness is checked whenever a queue operation times out: a worker that
+    # dies without posting a result (CUDA OOM, segfault, failed model load)
+    # aborts the run instead of hanging it forever.
     start_time = time.time()
     results = []
-    
-    with ProcessPoolExecutor(max_workers=total_processes) as executor:
-        future_to_job = {executor.submit(run_inference_job, job): job for job in jobs}
-        
-        for future in as_completed(future_to_job):
-            result = future.result()
-            results.append(result)
-            
-            successful = sum(1 for r in results if r['success'])
-            failed = sum(1 for r in results if not r['success'])
-            print(f"📊 Progress: {len(results)}/{len(jobs)} ({successful} ✅, {failed} ❌)")
-    
+
+    def check_workers_alive():
+        dead = [(p, gpu_id, log_path) for p, gpu_id, log_path in workers if not p.is_alive()]
+        if not dead:
+            return
+        for p, gpu_id, log_path in dead:
+            print(f"💀 Worker on GPU {gpu_id} died (exit code {p.exitcode}); log tail ({log_path}):")
+            print(tail_log(log_path))
+        raise RuntimeError(f"{len(dead)} worker(s) died before completing their jobs")
+
+    async def supervise():
+        abort = asyncio.Event()
+
+        async def feed():
+            for job in jobs:
+                while not abort.is_set():
+                    try:
+                        await asyncio.to_thread(input_q.put, job, True, 5)
+                        break
+                    except queue.Full:
+                        continue
+                if abort.is_set():
+                    return
+
+        async def drain():
+            for _ in range(len(jobs)):
+                while True:
+                    try:
+                        result = await asyncio.to_thread(result_q.get, True, 30)
+                        break
+                    except queue.Empty:
+                        try:
+                            check_workers_alive()
+                        except RuntimeError:
+                            abort.set()
+                            raise
+                results.append(result)
+
+                successful = sum(1 for r in results if r['success'])
+                failed = sum(1 for r in results if not r['success'])
+                print(f"📊 Progress: {len(results)}/{len(jobs)} ({successful} ✅, {failed} ❌)")
+
+        await asyncio.gather(feed(), drain())
+
+    try:
+        asyncio.run(supervise())
+    except RuntimeError as e:
+        print(f"\n❌ Aborting: {e}")
+        for p, _, _ in workers:
+            if p.is_alive():
+                p.terminate()
+        if mps_dir is not None:
+            stop_mps()
+        sys.exit(1)
+
+    # Shut the workers down
+    for _ in workers:
+        input_q.put(None)
+    for p, _, _ in workers:
+        p.join()
+
+    if mps_dir is not None:
+        stop_mps()
+
     total_time = time.time() - start_time
     successful_jobs = [r for r in results if r['success']]
     failed_jobs = [r for r in results if not r['success']]
@@ -124,14 +373,9 @@ def main():
     if failed_jobs:
         print(f"\n❌ Failed jobs:")
         for job in failed_jobs:
-            print(f"   GPU {job['gpu']}: {job['file']}")
-    
-    # Cleanup chunk files if created
-    if args.split_input:
-        for chunk_file in chunk_files:
-            if os.path.exists(chunk_file):
-                os.remove(chunk_file)
-                print(f"🧹 Cleaned up {chunk_file}")
+            print(f"   GPU {job['gpu']}: {job['file']} (log: {job.get('log', 'n/a')})")
+            if job.get('log'):
+                print(tail_log(job['log']))
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
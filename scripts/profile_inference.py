@@ -1,6 +1,10 @@
 import subprocess
 import os, sys
+import json
+import struct
+import yaml
 from glob import glob
+from multiprocessing import resource_tracker, shared_memory
 from datetime import datetime
 import time
 import torch
@@ -73,20 +77,23 @@ class ProfiledWanInferencePipeline(nn.Module):
                 self.audio_encoder.feature_extractor._freeze_parameters()
 
     def load_model(self):
-        dist.init_process_group(
-            backend="nccl",
-            init_method="env://",
-        )
-        from xfuser.core.distributed import (initialize_model_parallel,
-                                            init_distributed_environment)
-        init_distributed_environment(
-            rank=dist.get_rank(), world_size=dist.get_world_size())
-
-        initialize_model_parallel(
-            sequence_parallel_degree=args.sp_size,
-            ring_degree=1,
-            ulysses_degree=args.sp_size,
-        )
+        # Guarded so a resident server process can rebuild the pipeline for a
+        # new model config without re-initializing the process group
+        if not dist.is_initialized():
+            dist.init_process_group(
+                backend="nccl",
+                init_method="env://",
+            )
+            from xfuser.core.distributed import (initialize_model_parallel,
+                                                init_distributed_environment)
+            init_distributed_environment(
+                rank=dist.get_rank(), world_size=dist.get_world_size())
+
+            initialize_model_parallel(
+                sequence_parallel_degree=args.sp_size,
+                ring_degree=1,
+                ulysses_degree=args.sp_size,
+            )
         torch.cuda.set_device(dist.get_rank())
         ckpt_path = f'{args.exp_path}/pytorch_model.pt'
         assert os.path.exists(ckpt_path), f"pytorch_model.pt not found in {args.exp_path}"
@@ -345,7 +352,14 @@ class ProfiledWanInferencePipeline(nn.Module):
         print(f"   Generation speed: {fps_generation:.3f}x real-time")
         print(f"   Diffusion time: {total_diffusion_time:.3f}s ({total_diffusion_time/total_time*100:.1f}%)")
         print(f"   Steps per second: {num_steps * times / total_diffusion_time:.1f}")
-        
+
+        self.last_metrics = {
+            'total_time': total_time,
+            'video_duration': video_duration,
+            'generation_speed': fps_generation,
+            'diffusion_time': total_diffusion_time,
+        }
+
         return video
 
     def match_size(self, image_size, h, w):
@@ -394,23 +408,17 @@ def read_from_file(p):
         for l in fin:
             yield l.strip()
 
-def main():
-    set_seed(args.seed)
-    data_iter = read_from_file(args.input_file)
+def run_profiled(inferpipe, input_file):
+    """Profile every sample in input_file on a resident pipeline; returns aggregated metrics"""
+    data_iter = read_from_file(input_file)
     exp_name = os.path.basename(args.exp_path)
     seq_len = args.seq_len
     date_name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    
-    print("🔧 PROFILED INFERENCE STARTING")
-    print(f"📋 Configuration: {args.config}")
-    print(f"🎯 Target: {seq_len} frames, {args.num_steps} steps")
-    
-    inferpipe = ProfiledWanInferencePipeline(args)
     if args.sp_size > 1:
         date_name = inferpipe.pipe.sp_group.broadcast_object_list([date_name])
         date_name = date_name[0]
-        
-    output_dir = f'demo_out/{exp_name}/profiled_res_{os.path.splitext(os.path.basename(args.input_file))[0]}_'\
+
+    output_dir = f'demo_out/{exp_name}/profiled_res_{os.path.splitext(os.path.basename(input_file))[0]}_'\
                 f'seed{args.seed}_step{args.num_steps}_cfg{args.guidance_scale}_'\
                 f'ovlp{args.overlap_frame}_{args.max_tokens}_{args.fps}_{date_name}'
     if args.tea_cache_l1_thresh > 0:
@@ -419,7 +427,8 @@ def main():
         output_dir = f'{output_dir}_acfg{args.audio_scale}'
     if args.max_hw == 1280:
         output_dir = f'{output_dir}_720p'
-        
+
+    all_metrics = []
     for idx, text in tqdm(enumerate(data_iter)):
         if len(text) == 0:
             continue
@@ -454,7 +463,8 @@ def main():
             audio_path=input_audio_path,
             seq_len=seq_len
         )
-        
+        all_metrics.append(inferpipe.last_metrics)
+
         tmp2_audio_path = os.path.join(audio_dir, f"audio_out_{idx:03d}.wav")
         prompt_path = os.path.join(prompt_dir, f"prompt_{idx:03d}.txt") 
         
@@ -469,6 +479,165 @@ def main():
                                     prefix=f'result_{idx:03d}')
         dist.barrier()
 
+    # Aggregate per-sample metrics so callers get one machine-readable summary
+    if not all_metrics:
+        return {}
+    total_time = sum(m['total_time'] for m in all_metrics)
+    video_duration = sum(m['video_duration'] for m in all_metrics)
+    return {
+        'total_time': total_time,
+        'video_duration': video_duration,
+        'generation_speed': video_duration / total_time,
+        'diffusion_time': sum(m['diffusion_time'] for m in all_metrics),
+        'num_samples': len(all_metrics),
+    }
+
+def write_metrics_shm(shm_name, metrics):
+    """Pack the headline metrics into the caller's shared-memory block
+
+    Layout: three doubles at offset 0 — total_time, generation_speed,
+    video_duration. Cheaper than any file handoff and immune to log noise.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    except FileNotFoundError:
+        print(f"⚠️  Shared memory block {shm_name} not found, skipping metric handoff")
+        return
+    # The block belongs to the caller, which unlinks it itself; attaching
+    # registers it with this process's resource tracker anyway (until 3.13's
+    # track=False), which would spew bogus leak warnings at server exit
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    try:
+        shm.buf[:24] = struct.pack('ddd',
+                                   metrics.get('total_time', 0.0),
+                                   metrics.get('generation_speed', 0.0),
+                                   metrics.get('video_duration', 0.0))
+    finally:
+        shm.close()
+
+def apply_config(config_path):
+    """Reset args to the CLI baseline, then overlay config_path the way parse_args does"""
+    from OmniAvatar.utils import args_config
+
+    # Drop everything earlier configs (or their exp_path config.json) set, so
+    # a served run matches what a standalone --config run would produce
+    base = args_config.base_cli_args or {}
+    for key in list(vars(args)):
+        if key not in base:
+            delattr(args, key)
+    for key, value in base.items():
+        setattr(args, key, value)
+
+    with open(config_path, "r") as f:
+        yaml_config = yaml.safe_load(f)
+    for key, value in yaml_config.items():
+        if not hasattr(args, key) or getattr(args, key) is None:
+            setattr(args, key, value)
+    args.config = config_path
+
+    args.rank = int(os.getenv("RANK", "0"))
+    args.world_size = int(os.getenv("WORLD_SIZE", "1"))
+    args.local_rank = int(os.getenv("LOCAL_RANK", "0"))
+    args.device = f'cuda:{args.local_rank}'
+    args.num_nodes = int(os.getenv("NNODES", "1"))
+    debug = args.debug
+
+    if not os.path.exists(args.exp_path) and not args.exp_path.startswith('pretrained_models/'):
+        args.exp_path = f'checkpoints/{args.exp_path}'
+
+    if hasattr(args, 'reload_cfg') and args.reload_cfg:
+        conf_path = os.path.join(args.exp_path, "config.json")
+        if os.path.exists(conf_path):
+            print('| Reloading config from:', conf_path)
+            args_config.reload(args, conf_path)
+
+    if len(args.hparams) > 0:
+        hp_dict = args_config.parse_hp_string(args.hparams)
+        for key, value in hp_dict.items():
+            if not hasattr(args, key):
+                setattr(args, key, value)
+            elif isinstance(value, dict):
+                ori_v = getattr(args, key)
+                ori_v.update(value)
+                setattr(args, key, ori_v)
+            else:
+                setattr(args, key, value)
+    args.debug = debug
+
+# Config keys that require rebuilding the pipeline (everything else — steps,
+# TeaCache threshold, cfg scales — is read live from args at forward time)
+MODEL_KEYS = ('exp_path', 'dit_path', 'vae_path', 'text_encoder_path',
+              'wav2vec_path', 'dtype', 'sp_size', 'train_architecture')
+
+def model_signature():
+    return tuple(getattr(args, k, None) for k in MODEL_KEYS)
+
+def serve_main():
+    """Serve profiling requests over stdin so model weights stay warm across configs
+
+    Protocol: one JSON request per line, {"config": <yaml path>, "input": <txt path>},
+    answered with one JSON line {"success": ..., "metrics": ...} on the real stdout.
+    """
+    # Reserve the inherited stdout for the protocol; the chatty profiler
+    # output goes to stderr instead
+    proto_out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout = sys.stderr
+
+    print("🔧 PROFILED INFERENCE SERVER STARTING")
+
+    inferpipe = None
+    signature = None
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            apply_config(request['config'])
+            if inferpipe is None or model_signature() != signature:
+                if inferpipe is not None:
+                    print("🔁 Model config changed, rebuilding pipeline")
+                    # Drop the old pipeline before the rebuild is attempted, so
+                    # a failed construction leaves the loop recoverable: the
+                    # next request retries instead of tripping over stale state
+                    inferpipe = None
+                    signature = None
+                    torch.cuda.empty_cache()
+                inferpipe = ProfiledWanInferencePipeline(args)
+                signature = model_signature()
+            set_seed(args.seed)
+            metrics = run_profiled(inferpipe, request['input'])
+            if request.get('shm_name') and metrics:
+                write_metrics_shm(request['shm_name'], metrics)
+            response = {'success': True, 'metrics': metrics}
+        except Exception as e:
+            response = {'success': False, 'error': str(e)}
+        proto_out.write(json.dumps(response) + '\n')
+        proto_out.flush()
+
+def main():
+    set_seed(args.seed)
+
+    print("🔧 PROFILED INFERENCE STARTING")
+    print(f"📋 Configuration: {args.config}")
+    print(f"🎯 Target: {args.seq_len} frames, {args.num_steps} steps")
+
+    inferpipe = ProfiledWanInferencePipeline(args)
+    metrics = run_profiled(inferpipe, args.input_file)
+
+    # Hand metrics back machine-readably so callers (e.g. speed_benchmark.py)
+    # don't have to scrape stdout
+    if dist.get_rank() == 0 and metrics:
+        if args.shm_name is not None:
+            write_metrics_shm(args.shm_name, metrics)
+        if args.metrics_out is not None:
+            with open(args.metrics_out, 'w') as f:
+                json.dump(metrics, f, indent=2)
+            print(f"💾 Metrics written to {args.metrics_out}")
+
 class NoPrint:
     def write(self, x):
         pass
@@ -479,4 +648,7 @@ if __name__ == '__main__':
     if not args.debug:
         if args.local_rank != 0:
             sys.stdout = NoPrint()
-    main() 
\ No newline at end of file
+    if args.serve:
+        serve_main()
+    else:
+        main()
\ No newline at end of file
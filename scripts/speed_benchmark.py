@@ -4,13 +4,95 @@ Speed benchmark script for OmniAvatar inference optimization
 Tests different configurations to find the fastest settings
 """
 
+import argparse
 import subprocess
+import re
+import select
+import struct
+import threading
 import time
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 import tempfile
 
+SERVER_LOG = 'benchmark_server.log'
+
+# orjson serializes 2-4x faster than stdlib json; fall back silently when absent
+try:
+    import orjson
+    def dumps_result(result):
+        return orjson.dumps(result)
+except ImportError:
+    def dumps_result(result):
+        return json.dumps(result).encode()
+
+# Compiled once: one pass over the text instead of one substring scan per metric
+_METRIC_RE = re.compile(r'(Total inference time|Generation speed|Video duration):\s*([\d.]+)')
+_KEY_MAP = {
+    'Total inference time': 'total_time',
+    'Generation speed': 'generation_speed',
+    'Video duration': 'video_duration',
+}
+
+def parse_metrics_text(text):
+    """Fallback: recover the profiler's summary metrics from log text in a single pass"""
+    metrics = {}
+    for m in _METRIC_RE.finditer(text):
+        metrics[_KEY_MAP[m.group(1)]] = float(m.group(2))
+    return metrics
+
+def tail_log(log_path, nbytes=2048):
+    """Last nbytes of a log file, for failure reports"""
+    try:
+        with open(log_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - nbytes))
+            return f.read().decode(errors='replace')
+    except OSError:
+        return ''
+
+def start_server(config_file, gpu_id=None, log_path=None):
+    """Start a persistent profiling server so model weights stay warm across configs"""
+    cmd = [
+        'torchrun',
+        '--standalone',
+        '--nproc_per_node=1',
+        'scripts/profile_inference.py',
+        '--serve',
+        '--config', config_file
+    ]
+    env = os.environ.copy()
+    if gpu_id is not None:
+        env['CUDA_VISIBLE_DEVICES'] = str(gpu_id)
+        log_path = log_path or f'benchmark_server_gpu{gpu_id}.log'
+    log_path = log_path or SERVER_LOG
+    log = open(log_path, 'ab')
+    server = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=log, text=True, bufsize=1)
+    log.close()
+    server.log_path = log_path
+    return server
+
+def read_response(server, timeout=1800):
+    """Read one JSON response line from the server, honoring the per-run timeout"""
+    ready, _, _ = select.select([server.stdout], [], [], timeout)
+    if not ready:
+        raise TimeoutError(f'no response from benchmark server within {timeout}s')
+    line = server.stdout.readline()
+    if not line:
+        raise RuntimeError('benchmark server exited unexpectedly')
+    return json.loads(line)
+
+def stop_server(server):
+    try:
+        server.stdin.close()
+        server.wait(timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        server.kill()
+
 def create_test_input(duration_seconds=6):
     """Create a minimal test input for quick benchmarking"""
     content = f"A person speaking to camera for {duration_seconds} seconds@@examples/images/0000.jpeg@@examples/audios/0000.MP3"
@@ -19,55 +101,76 @@ def create_test_input(duration_seconds=6):
         f.write(content)
         return f.name
 
-def run_benchmark(config_file, test_input, description):
-    """Run a single benchmark test"""
+def run_benchmark(server, config_file, test_input, description):
+    """Run a single benchmark test against the resident profiling server"""
     print(f"\n🧪 Testing: {description}")
     print(f"   Config: {config_file}")
-    
-    cmd = [
-        'torchrun', 
-        '--standalone', 
-        '--nproc_per_node=1',
-        'scripts/profile_inference.py',
-        '--config', config_file,
-        '--input_file', test_input
-    ]
-    
+
+    # The headline metrics come back through a small shared-memory block:
+    # three packed doubles, no file to open or parse
+    try:
+        shm = shared_memory.SharedMemory(
+            create=True, size=4096,
+            name=f'omni_bench_{os.getpid()}_{threading.get_ident()}')
+    except OSError:
+        shm = None
+
     start_time = time.time()
-    
+
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=1800)  # 30 min timeout
+        request = {'config': config_file, 'input': test_input}
+        if shm is not None:
+            request['shm_name'] = shm.name
+        server.stdin.write(json.dumps(request) + '\n')
+        server.stdin.flush()
+        response = read_response(server, timeout=1800)  # 30 min timeout
         elapsed = time.time() - start_time
-        
-        # Extract performance metrics from output
-        lines = result.stdout.split('\n')
+
+        if not response.get('success'):
+            print(f"❌ Failed after {elapsed:.1f}s")
+            print(f"   Error: {response.get('error', 'unknown')}")
+            return {
+                'config': config_file,
+                'description': description,
+                'success': False,
+                'wall_time': elapsed,
+                'error': response.get('error', 'unknown')
+            }
+
         metrics = {}
-        
-        for line in lines:
-            if 'Total inference time:' in line:
-                metrics['total_time'] = float(line.split(':')[1].strip().replace('s', ''))
-            elif 'Generation speed:' in line:
-                metrics['generation_speed'] = float(line.split(':')[1].strip().replace('x real-time', ''))
-            elif 'Video duration:' in line:
-                metrics['video_duration'] = float(line.split(':')[1].strip().replace('s', ''))
-                
+        if shm is not None:
+            total_time, generation_speed, video_duration = struct.unpack_from('ddd', shm.buf)
+            if total_time > 0:
+                metrics = {
+                    'total_time': total_time,
+                    'generation_speed': generation_speed,
+                    'video_duration': video_duration,
+                }
+        if not metrics:
+            metrics = response.get('metrics', {})
+        if not metrics:
+            # The run succeeded but nothing structured came back; recover the
+            # profiler's summary lines from the log tail
+            metrics = parse_metrics_text(tail_log(server.log_path, 65536))
+
         print(f"✅ Success in {elapsed:.1f}s")
         if metrics:
             print(f"   Inference time: {metrics.get('total_time', 'N/A')}s")
             print(f"   Generation speed: {metrics.get('generation_speed', 'N/A')}x real-time")
-            
+
         return {
             'config': config_file,
             'description': description,
             'success': True,
             'wall_time': elapsed,
             'metrics': metrics,
-            'stdout': result.stdout[-1000:],  # Last 1000 chars for debugging
         }
-        
-    except subprocess.TimeoutExpired:
+
+    except TimeoutError:
         elapsed = time.time() - start_time
         print(f"⏰ Timeout after {elapsed:.1f}s")
+        print(f"   Server log tail:\n{tail_log(server.log_path)}")
+        server.kill()  # wedged; main() respawns the server for the next config
         return {
             'config': config_file,
             'description': description,
@@ -75,22 +178,36 @@ def run_benchmark(config_file, test_input, description):
             'wall_time': elapsed,
             'error': 'timeout'
         }
-    except subprocess.CalledProcessError as e:
+    except (OSError, RuntimeError, json.JSONDecodeError) as e:
         elapsed = time.time() - start_time
         print(f"❌ Failed after {elapsed:.1f}s")
-        print(f"   Error: {e.stderr[-500:]}")  # Last 500 chars of error
+        print(f"   Error: {e}")
+        print(f"   Server log tail:\n{tail_log(server.log_path)}")
         return {
             'config': config_file,
             'description': description,
             'success': False,
             'wall_time': elapsed,
-            'error': e.stderr[-500:]
+            'error': str(e)
         }
+    finally:
+        if shm is not None:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
 
 def main():
+    parser = argparse.ArgumentParser(description='Benchmark OmniAvatar inference configurations')
+    parser.add_argument('--gpus', default='0',
+                        help='Comma-separated GPU IDs; benchmarks are spread round-robin and run concurrently')
+    args = parser.parse_args()
+    gpu_ids = [int(x.strip()) for x in args.gpus.split(',')]
+
     print("🚀 OmniAvatar Speed Benchmark")
     print("=" * 50)
-    
+
     # Create test input
     test_input = create_test_input(6)  # 6 second test video
     print(f"📝 Created test input: {test_input}")
@@ -115,13 +232,28 @@ def main():
         return
     
     results = []
-    
-    print(f"\n🔍 Running {len(available_benchmarks)} benchmarks...")
-    
-    for config, description in available_benchmarks:
-        result = run_benchmark(config, test_input, description)
-        results.append(result)
-        
+
+    # Checkpoint each result as one NDJSON line the moment it lands, so a
+    # crash mid-sweep loses nothing
+    results_file = f"benchmark_results_{int(time.time())}.ndjson"
+    results_out = open(results_file, 'ab')
+
+    print(f"\n🔍 Running {len(available_benchmarks)} benchmarks on GPU(s) {gpu_ids}...")
+
+    # Round-robin the configs over the GPUs; each GPU gets its own warm
+    # server, and weights only reload when a config changes the model
+    assignments = {gpu_id: [] for gpu_id in gpu_ids}
+    for i, bench in enumerate(available_benchmarks):
+        assignments[gpu_ids[i % len(gpu_ids)]].append(bench)
+
+    record_lock = threading.Lock()
+
+    def record(result):
+        with record_lock:
+            results.append(result)
+            results_out.write(dumps_result(result) + b'\n')
+            results_out.flush()
+
         # Brief summary
         if result['success']:
             total_time = result.get('metrics', {}).get('total_time', result['wall_time'])
@@ -129,7 +261,23 @@ def main():
             print(f"   📊 {total_time:.1f}s ({speed}x real-time)")
         else:
             print(f"   ❌ Failed")
-    
+
+    def run_on_gpu(gpu_id):
+        assigned = assignments[gpu_id]
+        if not assigned:
+            return
+        server = start_server(assigned[0][0], gpu_id=gpu_id)
+        for config, description in assigned:
+            if server.poll() is not None:  # died or was killed after a timeout
+                server = start_server(config, gpu_id=gpu_id)
+            record(run_benchmark(server, config, test_input, description))
+        stop_server(server)
+
+    with ThreadPoolExecutor(max_workers=len(gpu_ids)) as executor:
+        futures = [executor.submit(run_on_gpu, gpu_id) for gpu_id in gpu_ids]
+        for future in futures:
+            future.result()
+
     # Final analysis
     print("\n" + "=" * 50)
     print("📊 BENCHMARK RESULTS SUMMARY")
@@ -170,10 +318,7 @@ def main():
     else:
         print("❌ No successful benchmarks to compare")
     
-    # Save detailed results
-    results_file = f"benchmark_results_{int(time.time())}.json"
-    with open(results_file, 'w') as f:
-        json.dump(results, f, indent=2)
+    results_out.close()
     print(f"\n💾 Detailed results saved to: {results_file}")
     
     # Cleanup